@@ -4,18 +4,24 @@
 Run this script and open the printed URL in a browser. Use the textarea to
 paste a DSL payload (YAML or JSON) and press "Submit" to enqueue it. The
 integration test runner can poll the `/next` endpoint to retrieve queued
-payloads one at a time.
+payloads one at a time. Polls are held open until a payload is queued or the
+`?wait=` timeout (default 25 s, max 60 s) expires; pass `?nowait=1` to get an
+immediate HTTP 204 when the queue is empty.
 """
 
 from __future__ import annotations
 
 import argparse
 import queue
+import select
+import socket
 import sys
+import threading
+import time
 from http import HTTPStatus
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from typing import List
-from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, Mapping
+from urllib.parse import parse_qs, unquote_to_bytes
 
 _HTML_PAGE = """<!DOCTYPE html>
 <html lang=\"en\">
@@ -43,16 +49,11 @@ _HTML_PAGE = """<!DOCTYPE html>
     const form = document.getElementById('enqueue-form');
     const queueLabel = document.getElementById('queue-size');
 
-    async function refreshStatus() {
-      try {
-        const response = await fetch('/status');
-        if (!response.ok) return;
-        const data = await response.json();
-        queueLabel.textContent = `Queued: ${data.size}`;
-      } catch (err) {
-        console.error('Failed to fetch status', err);
-      }
-    }
+    const events = new EventSource('/events');
+    events.onmessage = (event) => {
+      const data = JSON.parse(event.data);
+      queueLabel.textContent = `Queued: ${data.size}`;
+    };
 
     form.addEventListener('submit', async (event) => {
       event.preventDefault();
@@ -71,7 +72,6 @@ _HTML_PAGE = """<!DOCTYPE html>
         });
         if (response.ok) {
           form.reset();
-          await refreshStatus();
         } else {
           alert('Failed to enqueue payload.');
         }
@@ -79,110 +79,365 @@ _HTML_PAGE = """<!DOCTYPE html>
         alert('Request failed: ' + err);
       }
     });
-
-    setInterval(refreshStatus, 1500);
-    refreshStatus();
   </script>
 </body>
 </html>
 """
+_HTML_BYTES = _HTML_PAGE.encode("utf-8")
+_HTML_LEN = str(len(_HTML_BYTES))
+
+# Idle interval after which the /events stream sends a comment line, so dead
+# browser connections are noticed and their handler threads released.
+_EVENTS_KEEPALIVE_SECONDS = 15.0
+
+# How long a poll of the payload endpoint waits for a payload before it is
+# answered with HTTP 204, and the cap applied to the `?wait=` parameter.
+_DEFAULT_WAIT_SECONDS = 25.0
+_MAX_WAIT_SECONDS = 60.0
+
+# A held poll checks that its client is still connected at least this often,
+# so a payload is never taken on behalf of a poller that has gone away.
+_POLL_SLICE_SECONDS = 1.0
+
+# A keep-alive connection that sends nothing for this long is closed, so idle
+# or half-open clients do not hold a handler thread forever. Held polls do not
+# read the socket while they wait, so this does not cap `?wait=`.
+_IDLE_TIMEOUT_SECONDS = 120.0
+
+# Successful responses that are not logged on the polled paths.
+_QUIET_CODES = frozenset({HTTPStatus.OK, HTTPStatus.NO_CONTENT})
+
+# Content types whose /enqueue body carries the DSL in a `payload` field.
+_FORM_CTYPES = frozenset({"application/x-www-form-urlencoded", "multipart/form-data"})
+
+# Polls from this browser get an immediate HTTP 204 and never take a payload.
+_HEADLESS_UA = "HeadlessChrome"
+
+# Sent with every response; the same for all of them.
+_CORS_HEADERS = (
+    b"Access-Control-Allow-Origin: *\r\n"
+    b"Access-Control-Allow-Methods: GET, POST, OPTIONS\r\n"
+    b"Access-Control-Allow-Headers: Content-Type\r\n"
+)
+
+
+def _form_unquote(value: bytes) -> bytes:
+    return unquote_to_bytes(value.replace(b"+", b" "))
+
+
+def _form_value(body: bytes, key: bytes) -> bytes:
+    """Return the first non-empty ``key`` value of a form-encoded body.
+
+    Matches ``parse_qs(body)[key][0]``: fields without ``=`` or with an empty
+    value are skipped and key names are percent-decoded. Returns ``b""`` when
+    there is no such value.
+    """
+    start = 0
+    size = len(body)
+    while start < size:
+        end = body.find(b"&", start)
+        if end < 0:
+            end = size
+        eq = body.find(b"=", start, end)
+        if 0 <= eq < end - 1:
+            name = body[start:eq]
+            if name == key or (
+                (b"%" in name or b"+" in name) and _form_unquote(name) == key
+            ):
+                return _form_unquote(body[eq + 1 : end])
+        start = end + 1
+    return b""
+
+
+class _QueueServer(ThreadingHTTPServer):
+    # Long-polls and open streams must not keep Ctrl+C from exiting.
+    daemon_threads = True
+    allow_reuse_address = True
 
 
 def _build_handler(
-    items: queue.Queue[str],
+    items: queue.SimpleQueue[bytes],
     *,
     endpoint: str,
+    max_payload: int,
+    quiet: bool,
 ) -> type[BaseHTTPRequestHandler]:
     endpoint = endpoint.rstrip("/") or "/"
+    quiet_paths = frozenset({endpoint, "/status"})
+    subscribers: set[queue.SimpleQueue[int]] = set()
+    subscribers_lock = threading.Lock()
+
+    def _publish_size() -> None:
+        # Read the size under the lock so the last publish carries the latest
+        # size even when enqueue and next race.
+        with subscribers_lock:
+            size = items.qsize()
+            for updates in subscribers:
+                updates.put(size)
 
     class _Handler(BaseHTTPRequestHandler):
         server_version = "SimpleDSLQueue/0.1"
+        # Keep-alive lets pollers and the browser reuse one connection.
+        protocol_version = "HTTP/1.1"
+        timeout = _IDLE_TIMEOUT_SECONDS
+        # Whether this connection's client is headless Chrome; None until the
+        # first poll. A keep-alive connection always comes from one client.
+        _headless: bool | None = None
+        # Normalized path of the request being handled, set by _route().
+        _route_path = ""
+        # (queue size, encoded /status body, Content-Length) of the last reply.
+        _status_cache: tuple[int, bytes, str] = (-1, b"", "0")
 
         def log_message(self, format: str, *args) -> None:  # noqa: A003
-            sys.stderr.write("[server] " + format % args + "\n")
-
-        def _set_cors(self) -> None:
-            self.send_header("Access-Control-Allow-Origin", "*")
-            self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
-            self.send_header("Access-Control-Allow-Headers", "Content-Type")
-
-        def do_GET(self) -> None:  # noqa: N802
-            normalized_path = self.path.split("?", 1)[0].rstrip("/") or "/"
-
-            if normalized_path == endpoint:
-                self._handle_next()
+            line = (format % args).encode("utf-8", "backslashreplace")
+            sys.stderr.buffer.write(b"[server] %b\n" % line)
+            sys.stderr.buffer.flush()
+
+        def log_request(self, code: int | str = "-", size: int | str = "-") -> None:
+            # Successful polls and status refreshes are too frequent to be worth
+            # a line each.
+            if code in _QUIET_CODES and self._route_path in quiet_paths:
                 return
+            super().log_request(code, size)
 
-            if normalized_path == "/status":
-                self._handle_status()
+        def log_error(self, format: str, *args) -> None:  # noqa: A003
+            # Reaping an idle keep-alive connection is routine, not an error.
+            if format.startswith("Request timed out"):
                 return
+            super().log_error(format, *args)
 
-            if normalized_path == "/":
-                self._send_html(_HTML_PAGE)
-                return
-
-            self.send_error(HTTPStatus.NOT_FOUND, "Not Found")
+        def _response_head(
+            self,
+            status: int,
+            content_type: str | None = None,
+            length: str | None = None,
+            *,
+            reason: str | None = None,
+            extra_headers: tuple[str, ...] = (),
+        ) -> bytes:
+            if reason is None:
+                reason = self.responses[status][0] if status in self.responses else ""
+            self.log_request(status)
+            lines = [
+                f"{self.protocol_version} {status:d} {reason}",
+                f"Server: {self.version_string()}",
+                f"Date: {self.date_time_string()}",
+                "Connection: close" if self.close_connection else "Connection: keep-alive",
+            ]
+            if content_type is not None:
+                lines.append(f"Content-Type: {content_type}")
+            if length is not None:
+                lines.append(f"Content-Length: {length}")
+            lines.extend(extra_headers)
+            lines.append("")
+            head = "\r\n".join(lines).encode("latin-1", "strict")
+            return head + _CORS_HEADERS + b"\r\n"
+
+        def _send_full(
+            self,
+            status: int,
+            content_type: str | None = None,
+            body: bytes = b"",
+            *,
+            length: str | None = None,
+            reason: str | None = None,
+        ) -> None:
+            # Status line, headers and body go out in a single socket write.
+            if length is None and status != HTTPStatus.NO_CONTENT:
+                length = str(len(body))
+            head = self._response_head(status, content_type, length, reason=reason)
+            self.wfile.write(head + body)
 
-        def do_POST(self) -> None:  # noqa: N802
-            normalized_path = self.path.split("?", 1)[0].rstrip("/") or "/"
+        def _route(
+            self,
+            routes: Mapping[str, Callable[[_Handler], None]],
+        ) -> Callable[[_Handler], None] | None:
+            path = self.path
+            query = path.find("?")
+            if query >= 0:
+                path = path[:query]
+            path = self._route_path = path.rstrip("/") or "/"
+            return routes.get(path)
 
-            if normalized_path == "/enqueue":
-                self._handle_enqueue()
+        def do_GET(self) -> None:  # noqa: N802
+            handler = self._route(self.get_routes)
+            if handler is None:
+                self.send_error(HTTPStatus.NOT_FOUND, "Not Found")
                 return
+            handler(self)
 
-            if normalized_path == endpoint:
-                self._handle_next()
+        def do_POST(self) -> None:  # noqa: N802
+            handler = self._route(self.post_routes)
+            if handler is None:
+                self.send_error(HTTPStatus.METHOD_NOT_ALLOWED, "Method not allowed")
                 return
-
-            self.send_error(HTTPStatus.METHOD_NOT_ALLOWED, "Method not allowed")
+            handler(self)
 
         def do_OPTIONS(self) -> None:  # noqa: N802
-            self.send_response(HTTPStatus.NO_CONTENT)
-            self._set_cors()
-            self.end_headers()
+            self._send_full(HTTPStatus.NO_CONTENT)
 
         def _handle_next(self) -> None:
-            user_agent = self.headers.get("User-Agent", "")
-            if "HeadlessChrome" in user_agent:
-                self.send_response(HTTPStatus.NO_CONTENT)
-                self._set_cors()
-                self.end_headers()
+            headless = self._headless
+            if headless is None:
+                user_agent = self.headers.get("User-Agent", "")
+                headless = self._headless = _HEADLESS_UA in user_agent
+            if headless:
+                self._send_full(HTTPStatus.NO_CONTENT)
                 return
 
             try:
-                payload = items.get_nowait()
-            except queue.Empty:
-                self.send_response(HTTPStatus.NO_CONTENT)
-                self._set_cors()
-                self.end_headers()
+                payload = self._take(self._poll_timeout())
+            except ConnectionAbortedError:
+                self.close_connection = True
+                return
+            if payload is None:
+                self._send_full(HTTPStatus.NO_CONTENT)
                 return
 
-            data = payload.encode("utf-8")
-            self.send_response(HTTPStatus.OK)
-            self._set_cors()
-            self.send_header("Content-Type", "text/plain; charset=utf-8")
-            self.send_header("Content-Length", str(len(data)))
-            self.end_headers()
-            self.wfile.write(data)
+            _publish_size()
+            try:
+                self._send_full(HTTPStatus.OK, "text/plain; charset=utf-8", payload)
+            except OSError as exc:
+                self.close_connection = True
+                self.log_error(
+                    "Lost payload of %d bytes, client disconnected: %s",
+                    len(payload),
+                    exc,
+                )
+
+        def _take(self, timeout: float) -> bytes | None:
+            """Return the next payload, waiting up to ``timeout`` seconds.
+
+            Raises ConnectionAbortedError once the client has disconnected.
+            """
+            if not timeout:
+                try:
+                    return items.get_nowait()
+                except queue.Empty:
+                    return None
+
+            deadline = time.monotonic() + timeout
+            while True:
+                if not self._client_connected():
+                    raise ConnectionAbortedError
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                try:
+                    payload = items.get(timeout=min(remaining, _POLL_SLICE_SECONDS))
+                except queue.Empty:
+                    continue
+                if self._client_connected():
+                    return payload
+                # The client left while we were waiting; hand the payload back.
+                # It goes to the back of the queue, which only matters if other
+                # payloads were queued in the same instant.
+                items.put(payload)
+                self.log_error("Client disconnected during poll; payload requeued")
+                raise ConnectionAbortedError
+
+        def _client_connected(self) -> bool:
+            try:
+                readable, _, _ = select.select([self.connection], [], [], 0)
+                if not readable:
+                    return True
+                # Readable with no data means the peer closed the connection;
+                # pipelined request bytes are left in place by MSG_PEEK.
+                return self.connection.recv(1, socket.MSG_PEEK) != b""
+            except OSError:
+                return False
+
+        def _handle_next_post(self) -> None:
+            # The body is ignored; rather than read it, drop the connection.
+            length = self._content_length()
+            if length is None:
+                return
+            if length:
+                self.close_connection = True
+            self._handle_next()
+
+        def _content_length(self) -> int | None:
+            """Return the request's Content-Length, or None after a 400 reply."""
+            length = self.headers.get("Content-Length")
+            if not length:
+                return 0
+            # int() would accept "-1" or " 1_0"; a negative length makes
+            # rfile.read() block until EOF, so accept plain digits only.
+            if not (length.isascii() and length.isdigit()):
+                self.send_error(HTTPStatus.BAD_REQUEST, "Bad Content-Length")
+                return None
+            return int(length)
+
+        def _poll_timeout(self) -> float:
+            query = parse_qs(self.path.partition("?")[2], keep_blank_values=True)
+            if query.get("nowait", ["0"])[0] != "0":
+                return 0.0
+            try:
+                wait = float(query.get("wait", [_DEFAULT_WAIT_SECONDS])[0])
+            except ValueError:
+                wait = _DEFAULT_WAIT_SECONDS
+            if not wait > 0:
+                return 0.0
+            return min(wait, _MAX_WAIT_SECONDS)
 
         def _handle_status(self) -> None:
             size = items.qsize()
-            body = f"{{\"size\": {size}}}".encode("utf-8")
-            self.send_response(HTTPStatus.OK)
-            self._set_cors()
-            self.send_header("Content-Type", "application/json")
-            self.send_header("Content-Length", str(len(body)))
-            self.end_headers()
-            self.wfile.write(body)
+            cached_size, body, length = _Handler._status_cache
+            if cached_size != size:
+                body = f"{{\"size\": {size}}}".encode("utf-8")
+                length = str(len(body))
+                _Handler._status_cache = (size, body, length)
+            self._send_full(HTTPStatus.OK, "application/json", body, length=length)
+
+        def _handle_events(self) -> None:
+            updates: queue.SimpleQueue[int] = queue.SimpleQueue()
+            with subscribers_lock:
+                subscribers.add(updates)
+            try:
+                # The stream has no length, so it always ends the connection.
+                self.close_connection = True
+                head = self._response_head(
+                    HTTPStatus.OK,
+                    "text/event-stream",
+                    extra_headers=("Cache-Control: no-cache",),
+                )
+                last_size = items.qsize()
+                self.wfile.write(head + self._event(last_size))
+                while True:
+                    try:
+                        size = updates.get(timeout=_EVENTS_KEEPALIVE_SECONDS)
+                    except queue.Empty:
+                        self.wfile.write(b": keep-alive\n\n")
+                        continue
+                    if size != last_size:
+                        self.wfile.write(self._event(size))
+                        last_size = size
+            except (BrokenPipeError, ConnectionResetError, TimeoutError):
+                pass
+            finally:
+                with subscribers_lock:
+                    subscribers.discard(updates)
+
+        @staticmethod
+        def _event(size: int) -> bytes:
+            return f"data: {{\"size\": {size}}}\n\n".encode("utf-8")
 
         def _handle_enqueue(self) -> None:
-            length = int(self.headers.get("Content-Length", "0"))
-            raw_body = self.rfile.read(length).decode("utf-8") if length else ""
+            length = self._content_length()
+            if length is None:
+                return
+            if length > max_payload:
+                # Answer before reading the body; the unread bytes mean the
+                # connection cannot be reused.
+                self.close_connection = True
+                self.send_error(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Payload too large")
+                return
 
-            content_type = self.headers.get("Content-Type", "").split(";")[0].strip()
-            if content_type in {"application/x-www-form-urlencoded", "multipart/form-data"}:
-                payloads = parse_qs(raw_body).get("payload", [])
-                payload = payloads[0] if payloads else ""
+            # Payloads are queued as the received UTF-8 bytes and served as-is.
+            raw_body = self.rfile.read(length) if length else b""
+
+            if self.headers.get_content_type() in _FORM_CTYPES:
+                payload = _form_value(raw_body, b"payload")
             else:
                 payload = raw_body
 
@@ -192,17 +447,16 @@ def _build_handler(
                 return
 
             items.put(payload)
-            self.send_response(HTTPStatus.CREATED)
-            self._set_cors()
-            self.end_headers()
-
-        def _send_html(self, html: str) -> None:
-            data = html.encode("utf-8")
-            self.send_response(HTTPStatus.OK)
-            self.send_header("Content-Type", "text/html; charset=utf-8")
-            self.send_header("Content-Length", str(len(data)))
-            self.end_headers()
-            self.wfile.write(data)
+            _publish_size()
+            self._send_full(HTTPStatus.CREATED)
+
+        def _send_html(self) -> None:
+            self._send_full(
+                HTTPStatus.OK,
+                "text/html; charset=utf-8",
+                _HTML_BYTES,
+                length=_HTML_LEN,
+            )
 
         def send_error(  # type: ignore[override]
             self,
@@ -210,12 +464,32 @@ def _build_handler(
             message: str,
             explain: str | None = None,
         ) -> None:
-            self.send_response(code, message)
-            self._set_cors()
-            self.send_header("Content-Type", self.error_content_type)
-            self.end_headers()
+            # Like the stdlib version, never reuse a connection after an error:
+            # the request body may not have been read.
+            self.close_connection = True
             body = f"{code} {message}" if message else str(code)
-            self.wfile.write(body.encode("utf-8"))
+            self._send_full(
+                code,
+                self.error_content_type,
+                body.encode("utf-8"),
+                reason=message,
+            )
+
+        # Normalized request path -> handler. The payload endpoint is listed
+        # last for GET and first for POST, matching the old if-chain priority.
+        get_routes = {
+            "/": _send_html,
+            "/status": _handle_status,
+            "/events": _handle_events,
+            endpoint: _handle_next,
+        }
+        post_routes = {
+            endpoint: _handle_next_post,
+            "/enqueue": _handle_enqueue,
+        }
+
+    if quiet:
+        _Handler.log_request = lambda self, code="-", size="-": None  # type: ignore[method-assign]
 
     return _Handler
 
@@ -238,12 +512,28 @@ def main(argv: List[str]) -> int:
         default="/next",
         help="Endpoint the integration test polls for DSL payloads (default: /next)",
     )
+    parser.add_argument(
+        "--max-payload",
+        type=int,
+        default=1_000_000,
+        help="Reject enqueued payloads larger than this many bytes (default: 1000000)",
+    )
+    parser.add_argument(
+        "--quiet",
+        action="store_true",
+        help="Do not log requests",
+    )
 
     args = parser.parse_args(argv)
 
-    items: queue.Queue[str] = queue.Queue()
-    handler_cls = _build_handler(items, endpoint=args.endpoint)
-    server = HTTPServer((args.host, args.port), handler_cls)
+    items: queue.SimpleQueue[bytes] = queue.SimpleQueue()
+    handler_cls = _build_handler(
+        items,
+        endpoint=args.endpoint,
+        max_payload=args.max_payload,
+        quiet=args.quiet,
+    )
+    server = _QueueServer((args.host, args.port), handler_cls)
 
     print(
         "DSL queue server running at http://{host}:{port}/".format(
@@ -10,97 +10,286 @@ queued files have been served the server will keep responding with HTTP 204 so
 the client can continue polling. Pass ``--exit`` to send the configured exit
 command (default: ``exit``) instead, which lets the integration test terminate
 its interactive session automatically.
+
+While the queue is empty a poll is held open until a payload becomes available
+or the ``?wait=`` timeout (default 25 s, max 60 s) expires. Pass ``?nowait=1``
+to get an immediate HTTP 204 instead.
 """
 
 from __future__ import annotations
 
 import argparse
+import multiprocessing
+import os
 import pathlib
 import queue
+import signal
+import socket
 import sys
 from http import HTTPStatus
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from typing import List
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing.managers import SyncManager
+from typing import Callable, List, Mapping, Protocol
+from urllib.parse import parse_qs
+
+# How long a poll waits for a payload before it is answered with HTTP 204, and
+# the cap applied to the ``?wait=`` parameter.
+_DEFAULT_WAIT_SECONDS = 25.0
+_MAX_WAIT_SECONDS = 60.0
+
+# A keep-alive connection that sends nothing for this long is closed, so idle
+# or half-open clients do not hold a handler thread forever. Held polls do not
+# read the socket while they wait, so this does not cap ``?wait=``.
+_IDLE_TIMEOUT_SECONDS = 120.0
+
+# Successful responses that are not logged on the polled endpoint.
+_QUIET_CODES = frozenset({HTTPStatus.OK, HTTPStatus.NO_CONTENT})
+
+# Sent with every response; the same for all of them.
+_CORS_HEADERS = (
+    b"Access-Control-Allow-Origin: *\r\n"
+    b"Access-Control-Allow-Methods: GET, POST, OPTIONS\r\n"
+    b"Access-Control-Allow-Headers: Content-Type\r\n"
+)
+
 
+class _PathQueue(Protocol):
+    # Satisfied by queue.SimpleQueue and by the SyncManager queue proxy that
+    # --workers shares between processes.
+    def put(self, item: pathlib.Path) -> None: ...
 
-def _read_files(paths: List[str]) -> queue.Queue[str]:
-    items: queue.Queue[str] = queue.Queue()
+    def get(self, block: bool = ..., timeout: float | None = ...) -> pathlib.Path: ...
+
+    def get_nowait(self) -> pathlib.Path: ...
+
+
+def _resolve_files(paths: List[str]) -> List[pathlib.Path]:
+    # Only paths are queued; each file is streamed from disk when served.
+    resolved: List[pathlib.Path] = []
     for raw_path in paths:
         path = pathlib.Path(raw_path).expanduser().resolve()
         if not path.is_file():
             raise FileNotFoundError(f"DSL file not found: {path}")
-        content = path.read_text(encoding="utf-8")
-        items.put(content)
-    return items
+        resolved.append(path)
+    return resolved
+
+
+class _QueueServer(ThreadingHTTPServer):
+    # Held-open long-polls must not keep Ctrl+C from exiting.
+    daemon_threads = True
+    allow_reuse_address = True
+    reuse_port = False
+
+    def server_bind(self) -> None:
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+
+class _WorkerServer(_QueueServer):
+    # Every --workers process binds the same port and the kernel spreads
+    # incoming connections across them.
+    reuse_port = True
+
+    def service_actions(self) -> None:
+        # A worker whose main process died stops serving the stale queue
+        # rather than sharing the port with the next server started on it.
+        parent = multiprocessing.parent_process()
+        if parent is not None and not parent.is_alive():
+            raise SystemExit(0)
 
 
 def _build_handler(
-    items: queue.Queue[str],
+    items: _PathQueue,
     *,
     endpoint: str,
     exit_command: str,
     auto_exit: bool,
+    quiet: bool,
 ) -> type[BaseHTTPRequestHandler]:
     endpoint = endpoint.rstrip("/") or "/"
+    quiet_paths = frozenset({endpoint})
+    exit_payload = exit_command.encode("utf-8")
+
+    def _take(timeout: float) -> pathlib.Path | None:
+        try:
+            return items.get(timeout=timeout) if timeout else items.get_nowait()
+        except queue.Empty:
+            return None
 
     class _Handler(BaseHTTPRequestHandler):
         server_version = "TestQueueHTTP/0.1"
+        # Keep-alive lets the polling test runner reuse one connection.
+        protocol_version = "HTTP/1.1"
+        timeout = _IDLE_TIMEOUT_SECONDS
+        # Normalized path of the request being handled, set by _route().
+        _route_path = ""
 
         def log_message(self, format: str, *args) -> None:  # noqa: A003
-            sys.stderr.write("[server] " + format % args + "\n")
+            line = (format % args).encode("utf-8", "backslashreplace")
+            sys.stderr.buffer.write(b"[server] %b\n" % line)
+            sys.stderr.buffer.flush()
 
-        def _set_cors(self) -> None:
-            self.send_header("Access-Control-Allow-Origin", "*")
-            self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
-            self.send_header("Access-Control-Allow-Headers", "Content-Type")
+        def log_request(self, code: int | str = "-", size: int | str = "-") -> None:
+            # Successful polls are too frequent to be worth a line each.
+            if code in _QUIET_CODES and self._route_path in quiet_paths:
+                return
+            super().log_request(code, size)
+
+        def log_error(self, format: str, *args) -> None:  # noqa: A003
+            # Reaping an idle keep-alive connection is routine, not an error.
+            if format.startswith("Request timed out"):
+                return
+            super().log_error(format, *args)
+
+        def _response_head(
+            self,
+            status: int,
+            content_type: str | None = None,
+            length: str | None = None,
+            *,
+            reason: str | None = None,
+            extra_headers: tuple[str, ...] = (),
+        ) -> bytes:
+            if reason is None:
+                reason = self.responses[status][0] if status in self.responses else ""
+            self.log_request(status)
+            lines = [
+                f"{self.protocol_version} {status:d} {reason}",
+                f"Server: {self.version_string()}",
+                f"Date: {self.date_time_string()}",
+                "Connection: close" if self.close_connection else "Connection: keep-alive",
+            ]
+            if content_type is not None:
+                lines.append(f"Content-Type: {content_type}")
+            if length is not None:
+                lines.append(f"Content-Length: {length}")
+            lines.extend(extra_headers)
+            lines.append("")
+            head = "\r\n".join(lines).encode("latin-1", "strict")
+            return head + _CORS_HEADERS + b"\r\n"
+
+        def _send_full(
+            self,
+            status: int,
+            content_type: str | None = None,
+            body: bytes = b"",
+            *,
+            length: str | None = None,
+            reason: str | None = None,
+        ) -> None:
+            # Status line, headers and body go out in a single socket write.
+            if length is None and status != HTTPStatus.NO_CONTENT:
+                length = str(len(body))
+            head = self._response_head(status, content_type, length, reason=reason)
+            self.wfile.write(head + body)
+
+        def _route(
+            self,
+            routes: Mapping[str, Callable[[_Handler], None]],
+        ) -> Callable[[_Handler], None] | None:
+            path = self.path
+            query = path.find("?")
+            if query >= 0:
+                path = path[:query]
+            path = self._route_path = path.rstrip("/") or "/"
+            return routes.get(path)
 
         def do_GET(self) -> None:  # noqa: N802 (HTTP verb naming)
-            if self.path.rstrip("/") != endpoint:
+            handler = self._route(self.get_routes)
+            if handler is None:
                 self.send_error(HTTPStatus.NOT_FOUND, "Not Found")
                 return
+            handler(self)
 
-            try:
-                payload = items.get_nowait()
-            except queue.Empty:
+        def do_POST(self) -> None:  # noqa: N802
+            handler = self._route(self.post_routes)
+            if handler is None:
+                self.send_error(HTTPStatus.METHOD_NOT_ALLOWED, "Method not allowed")
+                return
+            handler(self)
+
+        def _handle_next(self) -> None:
+            # Nothing is requeued in exit mode, so an empty queue stays empty.
+            timeout = 0.0 if auto_exit else self._poll_timeout()
+            payload = _take(timeout)
+            if payload is None:
                 if not auto_exit:
-                    self.send_response(HTTPStatus.NO_CONTENT)
-                    self._set_cors()
-                    self.end_headers()
+                    self._send_full(HTTPStatus.NO_CONTENT)
                     return
 
-                payload = exit_command
-                self._send_payload(payload)
+                self._send_payload(exit_payload)
                 return
 
-            self._send_payload(payload)
+            self._send_file(payload)
 
             # Requeue payloads in cycling mode so they are served repeatedly.
             if not auto_exit:
                 items.put(payload)
 
-        def do_POST(self) -> None:  # noqa: N802
+        def _handle_exit(self) -> None:
             # Optional: allow POST /exit to terminate immediately.
-            if self.path.rstrip("/") == endpoint and not auto_exit:
-                length = int(self.headers.get("Content-Length", "0"))
+            if not auto_exit:
+                length = self._content_length()
+                if length is None:
+                    return
                 body = self.rfile.read(length).decode("utf-8") if length else ""
                 if body.strip().lower() == exit_command.lower():
-                    self._send_payload(exit_command)
+                    self._send_payload(exit_payload)
                     return
             self.send_error(HTTPStatus.METHOD_NOT_ALLOWED, "Method not allowed")
 
         def do_OPTIONS(self) -> None:  # noqa: N802
-            self.send_response(HTTPStatus.NO_CONTENT)
-            self._set_cors()
-            self.end_headers()
-
-        def _send_payload(self, payload: str) -> None:
-            data = payload.encode("utf-8")
-            self.send_response(HTTPStatus.OK)
-            self._set_cors()
-            self.send_header("Content-Type", "text/plain; charset=utf-8")
-            self.send_header("Content-Length", str(len(data)))
-            self.end_headers()
-            self.wfile.write(data)
+            self._send_full(HTTPStatus.NO_CONTENT)
+
+        def _content_length(self) -> int | None:
+            """Return the request's Content-Length, or None after a 400 reply."""
+            length = self.headers.get("Content-Length")
+            if not length:
+                return 0
+            # int() would accept "-1" or " 1_0"; a negative length makes
+            # rfile.read() block until EOF, so accept plain digits only.
+            if not (length.isascii() and length.isdigit()):
+                self.send_error(HTTPStatus.BAD_REQUEST, "Bad Content-Length")
+                return None
+            return int(length)
+
+        def _poll_timeout(self) -> float:
+            query = parse_qs(self.path.partition("?")[2], keep_blank_values=True)
+            if query.get("nowait", ["0"])[0] != "0":
+                return 0.0
+            try:
+                wait = float(query.get("wait", [_DEFAULT_WAIT_SECONDS])[0])
+            except ValueError:
+                wait = _DEFAULT_WAIT_SECONDS
+            if not wait > 0:
+                return 0.0
+            return min(wait, _MAX_WAIT_SECONDS)
+
+        def _send_payload(self, data: bytes) -> None:
+            self._send_full(HTTPStatus.OK, "text/plain; charset=utf-8", data)
+
+        def _send_file(self, path: pathlib.Path) -> None:
+            try:
+                source = path.open("rb")
+            except OSError as exc:
+                self.log_error("Cannot open %s: %s", path, exc)
+                self.send_error(HTTPStatus.INTERNAL_SERVER_ERROR, "DSL file unavailable")
+                return
+
+            with source:
+                length = os.fstat(source.fileno()).st_size
+                self.wfile.write(
+                    self._response_head(
+                        HTTPStatus.OK,
+                        "text/plain; charset=utf-8",
+                        str(length),
+                    )
+                )
+                # sendfile(2) copies from the page cache straight to the socket.
+                if length and self.connection.sendfile(source, 0, length) != length:
+                    # The file shrank after fstat(); the response is truncated.
+                    self.close_connection = True
 
         def send_error(  # type: ignore[override]
             self,
@@ -108,19 +297,65 @@ def _build_handler(
             message: str,
             explain: str | None = None,
         ) -> None:
-            self.send_response(code, message)
-            self._set_cors()
-            self.send_header("Content-Type", self.error_content_type)
-            self.end_headers()
+            # Like the stdlib version, never reuse a connection after an error:
+            # the request body may not have been read.
+            self.close_connection = True
             if message:
                 body = f"{code} {message}"
             else:
                 body = str(code)
-            self.wfile.write(body.encode("utf-8"))
+            self._send_full(
+                code,
+                self.error_content_type,
+                body.encode("utf-8"),
+                reason=message,
+            )
+
+        get_routes = {endpoint: _handle_next}
+        post_routes = {endpoint: _handle_exit}
+
+    if quiet:
+        _Handler.log_request = lambda self, code="-", size="-": None  # type: ignore[method-assign]
 
     return _Handler
 
 
+def _create_server(
+    args: argparse.Namespace,
+    items: _PathQueue,
+) -> _QueueServer:
+    handler_cls = _build_handler(
+        items,
+        endpoint=args.endpoint,
+        exit_command=args.exit_command,
+        auto_exit=args.exit,
+        quiet=args.quiet,
+    )
+    server_cls = _WorkerServer if args.workers > 1 else _QueueServer
+    return server_cls((args.host, args.port), handler_cls)
+
+
+def _serve(server: _QueueServer) -> None:
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def _run_worker(
+    args: argparse.Namespace,
+    items: _PathQueue,
+) -> None:
+    try:
+        _serve(_create_server(args, items))
+    except KeyboardInterrupt:
+        pass
+
+
+def _interrupt(signum: int, frame: object) -> None:
+    raise KeyboardInterrupt
+
+
 def main(argv: List[str]) -> int:
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument(
@@ -154,35 +389,74 @@ def main(argv: List[str]) -> int:
         action="store_true",
         help="After serving all files, send the exit command instead of HTTP 204",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of server processes sharing the port via SO_REUSEPORT (default: 1)",
+    )
+    parser.add_argument(
+        "--quiet",
+        action="store_true",
+        help="Do not log requests",
+    )
 
     args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        parser.error("--workers requires SO_REUSEPORT, which this platform lacks")
 
     try:
-        items = _read_files(args.paths)
+        paths = _resolve_files(args.paths)
     except FileNotFoundError as exc:
         parser.error(str(exc))
 
-    handler_cls = _build_handler(
-        items,
-        endpoint=args.endpoint,
-        exit_command=args.exit_command,
-        auto_exit=args.exit,
-    )
+    manager: SyncManager | None = None
+    items: _PathQueue = queue.SimpleQueue()
+    if args.workers > 1:
+        # Workers serve from one shared queue so each payload is handed out
+        # once, in order, whichever process accepts the poll.
+        manager = SyncManager()
+        manager.start()
+        items = manager.Queue()
+    for path in paths:
+        items.put(path)
 
-    server = HTTPServer((args.host, args.port), handler_cls)
-    print(
-        f"Serving {items.qsize()} DSL payload(s) on"
-        f" http://{args.host}:{args.port}{args.endpoint}",
-        flush=True,
-    )
-    print("Press Ctrl+C to stop.", flush=True)
+    # Stop on SIGTERM (kill, docker stop) the same way as on Ctrl+C, so the
+    # workers and the manager are shut down too. Workers inherit the handler.
+    signal.signal(signal.SIGTERM, _interrupt)
 
+    workers: List[multiprocessing.Process] = []
     try:
-        server.serve_forever()
-    except KeyboardInterrupt:
-        print("\nServer stopped.")
+        server = _create_server(args, items)
+        for _ in range(args.workers - 1):
+            worker = multiprocessing.Process(
+                target=_run_worker,
+                args=(args, items),
+                daemon=True,
+            )
+            worker.start()
+            workers.append(worker)
+
+        print(
+            f"Serving {len(paths)} DSL payload(s) on"
+            f" http://{args.host}:{args.port}{args.endpoint}"
+            + (f" with {args.workers} workers" if workers else ""),
+            flush=True,
+        )
+        print("Press Ctrl+C to stop.", flush=True)
+
+        try:
+            _serve(server)
+        except KeyboardInterrupt:
+            print("\nServer stopped.")
     finally:
-        server.server_close()
+        for worker in workers:
+            worker.terminate()
+            worker.join()
+        if manager is not None:
+            manager.shutdown()
 
     return 0
 